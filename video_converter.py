@@ -1,15 +1,54 @@
 import os
+import re
+import json
+import shutil
 import subprocess
-from pathlib import Path
-from concurrent.futures import ProcessPoolExecutor
+import sys
+import tempfile
 import multiprocessing
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from collections import Counter
+
+# Cœurs réellement disponibles (suit l'affinité CPU sous Linux, y compris cpuset ; pas les quotas --cpus)
+if hasattr(os, 'sched_getaffinity'):
+    _CPU_IDS = sorted(os.sched_getaffinity(0))
+else:
+    _CPU_IDS = list(range(os.cpu_count() or 1))
+_CPU_COUNT = len(_CPU_IDS)
+
+# Chemin de ffprobe résolu une seule fois
+FFPROBE_PATH = shutil.which('ffprobe') or 'ffprobe'
+
+VAAPI_DEVICE = '/dev/dri/renderD128'
+
+# Sessions NVENC simultanées sûres sur une carte grand public
+NVENC_MAX_SESSIONS = 3
+
+# Preset libx264 : 'faster' est nettement plus rapide que 'medium' à CRF égal
+X264_PRESET = 'faster'
+
+# Compromis vitesse/qualité VP9 : 2 (qualité), 4 (équilibré), 6 (rapide)
+VP9_CPU_USED = 4
+
+# SEQUENTIAL_WEBM=1 : encoder MP4 puis WebM l'un après l'autre (machines avec peu de cœurs)
+SEQUENTIAL_WEBM = os.environ.get('SEQUENTIAL_WEBM') == '1'
+
+# En dessous de cette durée (secondes), le WebM est encodé en une seule passe
+TWO_PASS_MIN_DURATION = 10
+
+# FORCE_REENCODE=1 : réencoder même les vidéos déjà présentes dans le dossier de sortie
+FORCE_REENCODE = os.environ.get('FORCE_REENCODE') == '1'
+
+# Cache des métadonnées ffprobe, stocké dans le dossier d'entrée
+VIDEO_CACHE_FILENAME = '.video_cache.json'
+
+# Caractères retirés des noms de fichiers (\w conserve les lettres accentuées, comme isalnum)
+_FILENAME_STRIP_RE = re.compile(r'[^\w-]+')
 
 def format_filename(filename):
     """Formater le nom de fichier en minuscules et remplacer les caractères spéciaux"""
-    formatted = filename.lower()
-    formatted = formatted.replace(' ', '-')
-    formatted = ''.join(c for c in formatted if c.isalnum() or c in '-_')
-    return formatted
+    return _FILENAME_STRIP_RE.sub('', filename.lower().replace(' ', '-'))
 
 def get_video_size_mb(file_path):
     """Obtenir la taille du fichier en MB"""
@@ -22,26 +61,113 @@ def get_supported_formats():
 def get_video_info(input_file):
     """Obtenir les informations détaillées de la vidéo"""
     cmd = [
-        'ffprobe',
+        FFPROBE_PATH,
         '-v', 'error',
+        '-probesize', '5M',
+        '-analyzeduration', '5M',
         '-select_streams', 'v:0',
         '-show_entries', 'stream=width,height,duration',
-        '-of', 'json',
+        '-of', 'csv=p=0',
         input_file
     ]
     try:
         output = subprocess.check_output(cmd).decode()
-        import json
-        info = json.loads(output)
-        stream_info = info.get('streams', [{}])[0]
+        # Une ligne "largeur,hauteur,durée" ; les champs absents valent "N/A"
+        width, height, duration = output.strip().splitlines()[0].split(',')[:3]
         return {
-            'width': int(stream_info.get('width', 0)),
-            'height': int(stream_info.get('height', 0)),
-            'duration': float(stream_info.get('duration', 0))
+            'width': int(width) if width.isdigit() else 0,
+            'height': int(height) if height.isdigit() else 0,
+            'duration': float(duration) if duration not in ('', 'N/A') else 0
         }
     except:
         return None
 
+def load_video_cache(input_dir):
+    """Charger le cache des métadonnées vidéo s'il existe"""
+    try:
+        with open(Path(input_dir) / VIDEO_CACHE_FILENAME) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    # Un cache au format inattendu est ignoré plutôt que d'interrompre le lot
+    if not isinstance(cache, dict) or not all(
+        isinstance(entry, dict)
+        and {'mtime', 'size', 'info'} <= entry.keys()
+        and isinstance(entry['info'], dict)
+        and {'width', 'height', 'duration'} <= entry['info'].keys()
+        for entry in cache.values()
+    ):
+        return {}
+    return cache
+
+def save_video_cache(input_dir, cache):
+    """Enregistrer le cache des métadonnées vidéo"""
+    try:
+        with open(Path(input_dir) / VIDEO_CACHE_FILENAME, 'w') as f:
+            json.dump(cache, f, indent=2)
+    except OSError as e:
+        print(f"Impossible d'enregistrer le cache : {e}")
+
+def get_cached_video_info(input_file, file_stat, cache):
+    """Obtenir les informations en cache si le fichier n'a pas changé depuis"""
+    entry = cache.get(str(input_file))
+    if (entry
+            and entry['mtime'] == file_stat.st_mtime
+            and entry['size'] == file_stat.st_size):
+        return entry['info']
+    return None
+
+def run_ffmpeg(cmd):
+    """Lancer ffmpeg sans conserver stdout ; stderr reste en octets et n'est décodé qu'en cas d'erreur"""
+    return subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+def run_ffmpeg_passes(cmds):
+    """Lancer plusieurs commandes ffmpeg à la suite en s'arrêtant à la première erreur"""
+    for cmd in cmds:
+        result = run_ffmpeg(cmd)
+        if result.returncode != 0:
+            break
+    return result
+
+def decode_ffmpeg_error(stderr):
+    """Décoder la fin de la sortie d'erreur de ffmpeg"""
+    return stderr[-4096:].decode('utf-8', 'replace')
+
+def detect_hardware_encoder():
+    """Détecter un encodeur matériel utilisable (NVENC ou VAAPI)"""
+    try:
+        output = subprocess.run(
+            ['ffmpeg', '-hide_banner', '-encoders'],
+            capture_output=True, text=True
+        ).stdout
+    except OSError:
+        return None
+
+    # Un encodeur listé n'implique pas un GPU présent : on valide par un encodage d'une image
+    def can_encode(encoder, device_args=(), video_filter='format=yuv420p'):
+        test_cmd = [
+            'ffmpeg', '-hide_banner', '-v', 'error',
+            *device_args,
+            '-f', 'lavfi', '-i', 'color=black:s=256x256',
+            '-frames:v', '1',
+            '-vf', video_filter,
+            '-c:v', encoder,
+            '-f', 'null', '-'
+        ]
+        return subprocess.run(test_cmd, capture_output=True).returncode == 0
+
+    if 'h264_nvenc' in output and can_encode('h264_nvenc'):
+        return {
+            'type': 'nvenc',
+            'av1': 'av1_nvenc' in output and can_encode('av1_nvenc')
+        }
+
+    if 'h264_vaapi' in output and os.path.exists(VAAPI_DEVICE):
+        if can_encode('h264_vaapi', ('-vaapi_device', VAAPI_DEVICE), 'format=nv12,hwupload'):
+            return {'type': 'vaapi', 'av1': False}
+
+    return None
+
 def calculate_target_bitrate(duration_seconds):
     """Calculer un bitrate cible basé sur la durée pour le format 1080x1920"""
     base_bitrate = 3000000  # 3Mbps base pour meilleure qualité vidéo
@@ -49,24 +175,115 @@ def calculate_target_bitrate(duration_seconds):
     target_size_bits = target_size_mb * 8 * 1024 * 1024
     return min(int(target_size_bits / duration_seconds), base_bitrate)
 
+def get_webm_video_args(bitrate, minrate, maxrate):
+    """Paramètres vidéo WebM : AV1 matériel si disponible, sinon VP9 logiciel"""
+    if HW_ENCODER and HW_ENCODER['av1']:
+        return [
+            '-c:v', 'av1_nvenc',
+            '-preset', 'p4',
+            '-rc', 'vbr',
+            '-b:v', f'{bitrate}',
+            '-maxrate', f'{maxrate}',
+            '-bufsize', f'{maxrate*2}',
+            '-g', '240',
+            '-pix_fmt', 'yuv420p',
+        ]
+    # Aux réglages rapides, l'anticipation coûte du temps sans gain de qualité notable
+    if VP9_CPU_USED >= 4:
+        vp9_lookahead_args = ['-auto-alt-ref', '0', '-lag-in-frames', '0']
+    else:
+        vp9_lookahead_args = ['-auto-alt-ref', '1', '-lag-in-frames', '25']
+    return [
+        '-c:v', 'libvpx-vp9',
+        '-b:v', f'{bitrate}',
+        '-minrate', f'{minrate}',
+        '-maxrate', f'{maxrate}',
+        '-deadline', 'good',
+        '-cpu-used', str(VP9_CPU_USED),
+        '-row-mt', '1',  # Multithreading par ligne, indispensable au-delà de 4 threads
+        '-tile-columns', '4',
+        '-tile-rows', '1',
+        *vp9_lookahead_args,
+        '-g', '240',
+        '-pix_fmt', 'yuv420p',
+    ]
+
+# Encodeur matériel détecté par batch_process_videos et transmis aux processus du pool
+HW_ENCODER = None
+
+def _init_worker(cpu_slices, hw_encoder):
+    """Initialiser un processus du pool : encodeur matériel détecté et affinité CPU"""
+    global HW_ENCODER
+    HW_ENCODER = hw_encoder
+    _pin_worker(cpu_slices)
+
+# Nombre de CPU de la tranche attribuée au processus courant (0 hors du pool)
+_WORKER_THREADS = 0
+
+def _pin_worker(cpu_slices):
+    """Fixer le processus (et les ffmpeg qu'il lance) sur une tranche de CPU dédiée"""
+    global _WORKER_THREADS
+    # Exactement une tranche par processus : l'attente bloquante ne peut pas durer
+    cpu_ids = cpu_slices.get()
+    _WORKER_THREADS = len(cpu_ids)
+    try:
+        if hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, cpu_ids)
+        elif sys.platform == 'win32':
+            import ctypes
+            from ctypes import wintypes
+            kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+            kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+            kernel32.SetProcessAffinityMask.argtypes = [wintypes.HANDLE, ctypes.c_size_t]
+            kernel32.SetProcessAffinityMask.restype = wintypes.BOOL
+            mask = sum(1 << cpu for cpu in cpu_ids)
+            if not kernel32.SetProcessAffinityMask(kernel32.GetCurrentProcess(), mask):
+                raise ctypes.WinError(ctypes.get_last_error())
+        # macOS : pas d'API d'affinité, on laisse faire l'ordonnanceur
+    except OSError as e:
+        print(f"Impossible de fixer l'affinité CPU : {e}")
+
 def process_video(args):
     """Traiter une vidéo unique avec compression agressive pour le web"""
-    input_file, output_dir = args
+    input_file, mp4_output_dir, webm_output_dir, video_info = args
+    # Dans le pool, le nombre de threads suit la tranche de CPU du processus ; tous les cœurs sinon
+    worker_threads = _WORKER_THREADS or _CPU_COUNT
     input_path = Path(input_file)
     filename = format_filename(input_path.stem)
     
-    mp4_output_dir = Path(output_dir) / "mp4"
-    webm_output_dir = Path(output_dir) / "webm"
-    mp4_output_dir.mkdir(parents=True, exist_ok=True)
-    webm_output_dir.mkdir(parents=True, exist_ok=True)
+    # Les dossiers de sortie sont créés par batch_process_videos
+    mp4_output = Path(mp4_output_dir, f"{filename}.mp4")
+    webm_output = Path(webm_output_dir, f"{filename}.webm")
+    # Encodage dans des fichiers temporaires renommés à la fin : une sortie interrompue n'est jamais prise pour terminée
+    mp4_part = Path(mp4_output_dir, f"{filename}.part.mp4")
+    webm_part = Path(webm_output_dir, f"{filename}.part.webm")
     
-    mp4_output = mp4_output_dir / f"{filename}.mp4"
-    webm_output = webm_output_dir / f"{filename}.webm"
+    # Reprise : ignorer les vidéos déjà converties (FORCE_REENCODE=1 pour tout réencoder)
+    if not FORCE_REENCODE:
+        try:
+            mp4_size = get_video_size_mb(mp4_output)
+            webm_size = get_video_size_mb(webm_output)
+        except OSError:
+            mp4_size = webm_size = 0
+        if mp4_size > 0 and webm_size > 0:
+            print(f"\n{input_file} déjà converti, ignoré")
+            return {
+                'filename': filename,
+                'input_file': input_file,
+                'video_info': video_info,
+                'original_size': get_video_size_mb(input_file),
+                'mp4_size': mp4_size,
+                'webm_size': webm_size,
+                'duration': video_info['duration'] if video_info else 0,
+                'skipped': True,
+                'success': True
+            }
     
     print(f"\nTraitement de {input_file}...")
     
-    # Obtenir les informations détaillées de la vidéo
-    video_info = get_video_info(input_file)
+    # Obtenir les informations détaillées de la vidéo (ffprobe uniquement hors cache)
+    if not video_info:
+        video_info = get_video_info(input_file)
     if not video_info:
         print(f"Erreur : Impossible d'obtenir les informations pour {input_file}")
         return
@@ -76,110 +293,183 @@ def process_video(args):
     
     # Calculer le bitrate optimal et le nombre de threads
     target_bitrate = calculate_target_bitrate(duration)
-    ffmpeg_threads = max(1, multiprocessing.cpu_count() // 2)
+    # En parallèle, MP4 et WebM se partagent les threads alloués au processus
+    if SEQUENTIAL_WEBM:
+        mp4_threads = webm_threads = worker_threads
+    else:
+        mp4_threads = (worker_threads + 1) // 2
+        webm_threads = max(1, worker_threads // 2)
     
     print(f"Bitrate cible : {target_bitrate/1024:.0f}kbps")
     
-    # Construction du filtre de redimensionnement
+    # Construction du filtre de redimensionnement (fast_bilinear : chemins SIMD de swscale)
     scale_filter = (
-        f"scale=1080:1920:force_original_aspect_ratio=increase,"
+        f"scale=1080:1920:force_original_aspect_ratio=increase:flags=fast_bilinear,"
         f"crop=1080:1920"
     )
     
     try:
         # Commande MP4 optimisée pour meilleure qualité vidéo
+        device_args = []
+        if HW_ENCODER and HW_ENCODER['type'] == 'nvenc':
+            # Encodage matériel NVIDIA
+            video_args = [
+                '-vf', f'{scale_filter},format=yuv420p',
+                '-c:v', 'h264_nvenc',
+                '-preset', 'p4',
+                '-tune', 'hq',
+                '-rc', 'vbr',
+                '-cq', '23',
+                '-b:v', f'{target_bitrate}',
+                '-maxrate', f'{target_bitrate*2}',
+                '-bufsize', f'{target_bitrate*2}',
+                '-profile:v', 'main',
+                '-level', '4.0',
+            ]
+        elif HW_ENCODER and HW_ENCODER['type'] == 'vaapi':
+            # Encodage matériel VAAPI (Linux), redimensionnement côté CPU pour conserver le recadrage
+            device_args = ['-vaapi_device', VAAPI_DEVICE]
+            video_args = [
+                '-vf', f'{scale_filter},format=nv12,hwupload',
+                '-c:v', 'h264_vaapi',
+                '-b:v', f'{target_bitrate}',
+                '-maxrate', f'{target_bitrate}',
+                '-bufsize', f'{target_bitrate*2}',
+                '-profile:v', 'main',
+                '-level', '4',  # h264_vaapi nomme ses niveaux "4", "4.1"... sans "4.0"
+            ]
+        else:
+            video_args = [
+                '-vf', f'{scale_filter},format=yuv420p',
+                '-c:v', 'libx264',
+                '-crf', '20',
+                '-preset', X264_PRESET,
+                '-tune', 'film',
+                '-profile:v', 'main',
+                '-maxrate', f'{target_bitrate}',
+                '-bufsize', f'{target_bitrate*2}',
+                '-level', '4.0',
+            ]
+
         mp4_cmd = [
             'ffmpeg', '-y',
+            '-loglevel', 'error', '-nostats',
+            *device_args,
             '-i', str(input_file),
-            '-threads', str(ffmpeg_threads),
-            '-vf', f'{scale_filter},format=yuv420p',
-            '-c:v', 'libx264',
-            '-crf', '20',
-            '-preset', 'medium',
-            '-profile:v', 'main',
-            '-level', '4.0',
-            '-maxrate', f'{target_bitrate}',
-            '-bufsize', f'{target_bitrate*2}',
-            '-movflags', '+faststart',
+            '-threads', str(mp4_threads),
+            '-filter_threads', str(mp4_threads),
+            '-sws_flags', 'fast_bilinear',
+            *video_args,
+            # MP4 fragmenté : moov en tête dès l'écriture, sans seconde passe de réécriture
+            '-movflags', '+frag_keyframe+empty_moov+default_base_moof',
             '-color_primaries', 'bt709',
             '-color_trc', 'bt709',
             '-colorspace', 'bt709',
             '-c:a', 'aac',
             '-b:a', '128k',
             '-ar', '48000',
-            str(mp4_output)
+            str(mp4_part)
         ]
         
-        result = subprocess.run(mp4_cmd, capture_output=True, text=True)
-        if result.returncode != 0:
-            print("Erreur MP4:", result.stderr)
-            raise subprocess.CalledProcessError(result.returncode, mp4_cmd, result.stdout, result.stderr)
-
-        # Si le MP4 est créé avec succès, créer le WebM avec meilleure qualité vidéo
-        if mp4_output.exists():
-            webm_cmd = [
-                'ffmpeg', '-y',
-                '-i', str(mp4_output),
-                '-threads', str(ffmpeg_threads),
-                '-c:v', 'libvpx-vp9',
-                '-b:v', f'{int(target_bitrate*0.9)}',
-                '-minrate', f'{int(target_bitrate*0.6)}',
-                '-maxrate', f'{target_bitrate}',
-                '-tile-columns', '2',
-                '-frame-parallel', '1',
-                '-speed', '1',  # Meilleure qualité d'encodage
-                '-auto-alt-ref', '1',
-                '-lag-in-frames', '25',
-                '-g', '240',
-                '-pix_fmt', 'yuv420p',
-                '-c:a', 'libopus',
-                '-b:a', '96k',  # Paramètres audio d'origine
-                str(webm_output)
-            ]
-            
-            result = subprocess.run(webm_cmd, capture_output=True, text=True)
-            if result.returncode != 0:
-                print("Erreur WebM:", result.stderr)
-                raise subprocess.CalledProcessError(result.returncode, webm_cmd, result.stdout, result.stderr)
-            
+        # Commande WebM encodée depuis la source pour ne pas dépendre du MP4
+        webm_base_cmd = [
+            'ffmpeg', '-y',
+            '-loglevel', 'error', '-nostats',
+            '-i', str(input_file),
+            '-threads', str(webm_threads),
+            '-filter_threads', str(webm_threads),
+            '-sws_flags', 'fast_bilinear',
+            '-vf', f'{scale_filter},format=yuv420p',
+            *get_webm_video_args(
+                int(target_bitrate*0.9),
+                int(target_bitrate*0.6),
+                target_bitrate
+            ),
+        ]
+        webm_audio_args = [
+            '-c:a', 'libopus',
+            '-b:a', '96k',  # Paramètres audio d'origine
+        ]
+
+        # Deux passes VP9 : taille maîtrisée sans réencodage a posteriori
+        two_pass = (
+            duration >= TWO_PASS_MIN_DURATION
+            and not (HW_ENCODER and HW_ENCODER['av1'])
+        )
+
+        # Dossier temporaire propre à chaque vidéo pour les journaux de passe
+        with tempfile.TemporaryDirectory(prefix='webm-passlog-') as passlog_dir:
+            if two_pass:
+                passlog = os.path.join(passlog_dir, 'vp9')
+                webm_cmds = [
+                    [*webm_base_cmd, '-pass', '1', '-passlogfile', passlog,
+                     '-an', '-f', 'webm', os.devnull],
+                    [*webm_base_cmd, '-pass', '2', '-passlogfile', passlog,
+                     *webm_audio_args, str(webm_part)],
+                ]
+            else:
+                webm_cmds = [[*webm_base_cmd, *webm_audio_args, str(webm_part)]]
+
+            if SEQUENTIAL_WEBM:
+                mp4_result = run_ffmpeg(mp4_cmd)
+                webm_result = run_ffmpeg_passes(webm_cmds) if mp4_result.returncode == 0 else None
+            else:
+                # Les deux encodages tournent en même temps ; les threads lisent les sorties en continu
+                with ThreadPoolExecutor(max_workers=2) as encoders:
+                    mp4_future = encoders.submit(run_ffmpeg, mp4_cmd)
+                    webm_future = encoders.submit(run_ffmpeg_passes, webm_cmds)
+                    mp4_result = mp4_future.result()
+                    webm_result = webm_future.result()
+
+        if mp4_result.returncode != 0:
+            print("Erreur MP4:", decode_ffmpeg_error(mp4_result.stderr))
+            raise subprocess.CalledProcessError(mp4_result.returncode, mp4_cmd, mp4_result.stdout, mp4_result.stderr)
+        if webm_result.returncode != 0:
+            print("Erreur WebM:", decode_ffmpeg_error(webm_result.stderr))
+            raise subprocess.CalledProcessError(webm_result.returncode, webm_result.args, webm_result.stdout, webm_result.stderr)
+
+        if mp4_part.exists():
             # Vérifier les tailles finales
-            mp4_size = get_video_size_mb(mp4_output)
-            webm_size = get_video_size_mb(webm_output)
+            mp4_size = get_video_size_mb(mp4_part)
+            webm_size = get_video_size_mb(webm_part)
             
             print(f"\nRésultats de compression:")
             print(f"Original: {file_size_mb:.2f}MB")
             print(f"MP4: {mp4_size:.2f}MB ({(mp4_size/file_size_mb)*100:.1f}%)")
             print(f"WebM: {webm_size:.2f}MB ({(webm_size/file_size_mb)*100:.1f}%)")
             
-            # Si le WebM est plus grand que le MP4, on le recrée avec des paramètres ajustés
-            if webm_size > mp4_size:
+            # En une seule passe, si le WebM est plus grand que le MP4, on le recrée avec des paramètres ajustés
+            if not two_pass and webm_size > mp4_size:
                 print("Le WebM est plus grand que le MP4, nouvelle tentative avec bitrate réduit...")
                 webm_cmd = [
                     'ffmpeg', '-y',
-                    '-i', str(mp4_output),
-                    '-threads', str(ffmpeg_threads),
-                    '-c:v', 'libvpx-vp9',
-                    '-b:v', f'{int(target_bitrate*0.7)}',
-                    '-minrate', f'{int(target_bitrate*0.4)}',
-                    '-maxrate', f'{int(target_bitrate*0.8)}',
-                    '-tile-columns', '2',
-                    '-frame-parallel', '1',
-                    '-speed', '1',
-                    '-auto-alt-ref', '1',
-                    '-lag-in-frames', '25',
-                    '-g', '240',
-                    '-pix_fmt', 'yuv420p',
+                    '-loglevel', 'error', '-nostats',
+                    '-i', str(input_file),
+                    '-threads', str(worker_threads),
+                    '-filter_threads', str(worker_threads),
+                    '-sws_flags', 'fast_bilinear',
+                    '-vf', f'{scale_filter},format=yuv420p',
+                    *get_webm_video_args(
+                        int(target_bitrate*0.7),
+                        int(target_bitrate*0.4),
+                        int(target_bitrate*0.8)
+                    ),
                     '-c:a', 'libopus',
                     '-b:a', '96k',  # Paramètres audio d'origine
-                    str(webm_output)
+                    str(webm_part)
                 ]
                 
-                subprocess.run(webm_cmd, check=True, capture_output=True)
-                webm_size = get_video_size_mb(webm_output)
+                run_ffmpeg(webm_cmd).check_returncode()
+                webm_size = get_video_size_mb(webm_part)
                 print(f"Nouveau WebM: {webm_size:.2f}MB ({(webm_size/file_size_mb)*100:.1f}%)")
             
+            os.replace(mp4_part, mp4_output)
+            os.replace(webm_part, webm_output)
+            
             return {
                 'filename': filename,
+                'input_file': input_file,
+                'video_info': video_info,
                 'original_size': file_size_mb,
                 'mp4_size': mp4_size,
                 'webm_size': webm_size,
@@ -189,63 +479,125 @@ def process_video(args):
             
     except subprocess.CalledProcessError as e:
         print(f"Erreur lors du traitement de {input_file}")
-        print(f"Sortie d'erreur : {e.stderr if hasattr(e, 'stderr') else str(e)}")
+        print(f"Sortie d'erreur : {decode_ffmpeg_error(e.stderr) if e.stderr else str(e)}")
+        mp4_part.unlink(missing_ok=True)
+        webm_part.unlink(missing_ok=True)
         return {
             'filename': filename,
+            'input_file': input_file,
+            'video_info': video_info,
             'error': str(e),
             'success': False
         }
 
 def batch_process_videos(input_dir, output_dir):
     """Traiter tous les fichiers vidéo en parallèle"""
-    input_path = Path(input_dir)
-    supported_formats = get_supported_formats()
-    
-    # Récupérer tous les fichiers du dossier
-    all_files = list(input_path.glob("*"))
+    supported_formats = frozenset(get_supported_formats())
     
-    # Filtrer les fichiers vidéo supportés
-    video_files = [f for f in all_files if f.suffix.lower() in supported_formats]
-    unsupported_files = [f for f in all_files if f not in video_files]
+    # Parcourir le dossier une seule fois : tri des fichiers et comptage des formats
+    # (scandir met en cache le stat de chaque entrée)
+    video_files, unsupported_files, format_count = [], [], Counter()
+    with os.scandir(input_dir) as it:
+        for entry in it:
+            if not entry.is_file() or entry.name == VIDEO_CACHE_FILENAME:
+                continue
+            ext = Path(entry.name).suffix.lower()
+            if ext in supported_formats:
+                video_files.append(entry)
+                format_count[ext] += 1
+            else:
+                unsupported_files.append(entry.name)
     
     if not video_files:
         print("Aucun fichier vidéo supporté trouvé dans le dossier d'entrée")
         return
     
     print("\n=== Analyse des fichiers ===")
-    print(f"Nombre total de fichiers dans le dossier : {len(all_files)}")
+    print(f"Nombre total de fichiers dans le dossier : {len(video_files) + len(unsupported_files)}")
     print(f"Fichiers vidéo supportés : {len(video_files)}")
     
     # Afficher les détails des formats trouvés
-    format_count = {}
-    for video in video_files:
-        ext = video.suffix.lower()
-        format_count[ext] = format_count.get(ext, 0) + 1
-    
     print("\nDétail des formats trouvés :")
     for fmt, count in format_count.items():
         print(f"- {fmt}: {count} fichiers")
     
     if unsupported_files:
         print("\nFichiers ignorés :")
-        for f in unsupported_files:
-            print(f"- {f.name}")
+        for name in unsupported_files:
+            print(f"- {name}")
+    
+    # Détection unique de l'encodeur matériel, transmise ensuite aux processus
+    hw_encoder = detect_hardware_encoder()
     
-    max_workers = max(1, multiprocessing.cpu_count() - 1)
+    # Pas plus de processus que de vidéos : un petit lot garde tous les cœurs
+    max_workers = max(1, min(_CPU_COUNT - 1, len(video_files)))
+    if hw_encoder and hw_encoder['type'] == 'nvenc':
+        # Les cartes NVIDIA grand public limitent le nombre de sessions NVENC simultanées
+        sessions_per_worker = 2 if hw_encoder['av1'] and not SEQUENTIAL_WEBM else 1
+        max_workers = min(max_workers, max(1, NVENC_MAX_SESSIONS // sessions_per_worker))
+        print(f"\nEncodage matériel NVENC détecté (AV1 : {'oui' if hw_encoder['av1'] else 'non'})")
+    elif hw_encoder:
+        print("\nEncodage matériel VAAPI détecté")
+    # Répartir tous les cœurs entre les processus, le reste de la division allant aux premiers
+    worker_threads = [
+        _CPU_COUNT // max_workers + (1 if i < _CPU_COUNT % max_workers else 0)
+        for i in range(max_workers)
+    ]
     print(f"\nDémarrage du traitement avec {max_workers} processus en parallèle")
     print(f"Nombre total de vidéos à traiter : {len(video_files)}\n")
     
-    process_args = [(str(video_file), output_dir) for video_file in video_files]
+    # Créer les dossiers de sortie une seule fois avant de lancer les processus
+    mp4_output_dir = Path(output_dir, "mp4")
+    webm_output_dir = Path(output_dir, "webm")
+    mp4_output_dir.mkdir(parents=True, exist_ok=True)
+    webm_output_dir.mkdir(parents=True, exist_ok=True)
+    
+    video_cache = load_video_cache(input_dir)
+    # Les plus gros fichiers d'abord pour réduire la durée totale du lot
+    video_files.sort(key=lambda e: e.stat().st_size, reverse=True)
+    process_args = [
+        (
+            video_file.path,
+            str(mp4_output_dir),
+            str(webm_output_dir),
+            get_cached_video_info(video_file.path, video_file.stat(), video_cache)
+        )
+        for video_file in video_files
+    ]
     
     results = []
-    with ProcessPoolExecutor(max_workers=max_workers) as executor:
-        results = list(executor.map(process_video, process_args))
+    # Une tranche de CPU disjointe par processus pour préserver les caches ; sa taille
+    # fixe aussi le nombre de threads ffmpeg du processus (tous les CPU sont attribués)
+    cpu_slices = multiprocessing.Queue()
+    start = 0
+    for count in worker_threads:
+        cpu_slices.put(_CPU_IDS[start:start + count])
+        start += count
+    
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(cpu_slices, hw_encoder)) as executor:
+        futures = [executor.submit(process_video, a) for a in process_args]
+        for done, future in enumerate(as_completed(futures), 1):
+            results.append(future.result())
+            print(f"Progression : {done}/{len(futures)}")
+    
+    # Mettre à jour le cache avec les informations obtenues par les processus
+    for r in results:
+        if r and r.get('video_info'):
+            file_stat = os.stat(r['input_file'])
+            video_cache[r['input_file']] = {
+                'mtime': file_stat.st_mtime,
+                'size': file_stat.st_size,
+                'info': r['video_info']
+            }
+    save_video_cache(input_dir, video_cache)
     
     print("\n=== Résumé du traitement ===")
     successful = [r for r in results if r and r.get('success', False)]
     failed = [r for r in results if r and not r.get('success', False)]
     
-    print(f"\nVidéos traitées avec succès: {len(successful)}")
+    skipped = [r for r in successful if r.get('skipped', False)]
+    
+    print(f"\nVidéos traitées avec succès: {len(successful)} (dont {len(skipped)} déjà converties)")
     print(f"Échecs: {len(failed)}")
     
     if failed: